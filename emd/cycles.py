@@ -421,9 +421,10 @@ def mean_vector(IP, X, mask=None):
     Parameters
     ----------
     IP : ndarray
-        Instantaneous Phase values
+        1D array of instantaneous phase values
     X : ndarray
-        Observations corresponding to IP values
+        2D [samples x features] array of observations corresponding to IP
+        values
     mask :
          (Default value = None)
 
@@ -435,9 +436,10 @@ def mean_vector(IP, X, mask=None):
 
     """
 
-    phi = np.cos(IP) + 1j * np.sin(IP)
-    mv = phi[:, None] * X
-    return mv.mean(axis=0)
+    # Project the real and imaginary parts separately to avoid building a
+    # full complex copy of X before averaging over time
+    mv = np.cos(IP).dot(X) + 1j * np.sin(IP).dot(X)
+    return mv / X.shape[0]
 
 
 def basis_project(X, ncomps=1, ret_basis=False):
@@ -447,9 +449,10 @@ def basis_project(X, ncomps=1, ret_basis=False):
     Parameters
     ----------
     IP : ndarray
-        Instantaneous Phase values
+        1D array of instantaneous phase values
     X : ndarray
-        Observations corresponding to IP values
+        2D [samples x features] array of observations corresponding to IP
+        values
     ncomps : int
         Number of sine-cosine pairs to express signal in (default=1)
     ret_basis : bool
@@ -24,7 +24,9 @@ define_hist_bins_from_data
 """
 
 import logging
+import functools
 import numpy as np
+from scipy import fft as sp_fft
 from scipy import signal, sparse
 
 from . import utils
@@ -84,7 +86,7 @@ def frequency_stats(imf, sample_rate, method,
     if method == 'hilbert':
         logger.info('Using Hilbert transform')
 
-        analytic_signal = signal.hilbert(imf, axis=0)
+        analytic_signal = _hilbert(imf)
 
         # Estimate instantaneous amplitudes directly from analytic signal
         iamp = np.abs(analytic_signal)
@@ -93,39 +95,18 @@ def frequency_stats(imf, sample_rate, method,
         logger.info('Using Amplitude-Normalised Hilbert transform')
 
         n_imf = utils.amplitude_normalise(imf)
-        analytic_signal = signal.hilbert(n_imf, axis=0)
-
-        orig_dim = imf.ndim
-        if imf.ndim == 2:
-            imf = imf[:, :, None]
+        analytic_signal = _hilbert(n_imf)
 
         # Estimate inst amplitudes with spline interpolation
-        iamp = np.zeros_like(imf)
-        for ii in range(imf.shape[1]):
-            for jj in range(imf.shape[2]):
-                iamp[:, ii, jj] = utils.interp_envelope(imf[:, ii, jj],
-                                                        mode='upper')
-        if orig_dim == 2:
-            iamp = iamp[:, :, 0]
+        iamp = _interp_envelopes(imf, mode='upper')
 
     elif method == 'quad':
         logger.info('Using Quadrature transform')
 
         analytic_signal = quadrature_transform(imf)
 
-        orig_dim = imf.ndim
-        if imf.ndim == 2:
-            imf = imf[:, :, None]
-
         # Estimate inst amplitudes with spline interpolation
-        iamp = np.zeros_like(imf)
-        for ii in range(imf.shape[1]):
-            for jj in range(imf.shape[2]):
-                iamp[:, ii, jj] = utils.interp_envelope(imf[:, ii, jj],
-                                                        mode='upper')
-
-        if orig_dim == 2:
-            iamp = iamp[:, :, 0]
+        iamp = _interp_envelopes(imf, mode='upper')
 
     elif method == 'direct_quad':
         logger.info('Using Direct-Quadrature transform')
@@ -156,6 +137,91 @@ def frequency_stats(imf, sample_rate, method,
 # Frequency stat utils
 
 
+def _as_time_last(X):
+    """
+    Move the time dimension of an array from first to last and make sure it
+    is contiguous in memory, so that each time-series can be processed
+    without strided reads.
+
+    Parameters
+    ----------
+    X : ndarray
+        Input array, time is assumed to be the first dimension
+
+    Returns
+    -------
+    ndarray
+        C-contiguous array with time as the last dimension
+
+    """
+    return np.ascontiguousarray(np.moveaxis(X, 0, -1))
+
+
+def _hilbert(X):
+    """
+    Compute the analytic signal of a set of time-series using the Hilbert
+    transform.
+
+    Parameters
+    ----------
+    X : ndarray
+        Array of real valued time-series, time is assumed to be the first
+        dimension
+
+    Returns
+    -------
+    ndarray
+        Complex valued analytic signal, same shape as X
+
+    """
+
+    # FFTs are faster along contiguous memory
+    X = _as_time_last(X)
+    N = X.shape[-1]
+
+    # Parallelise the FFTs across all available cores
+    Xf = sp_fft.fft(X, axis=-1, workers=-1)
+
+    # Double positive and remove negative frequencies in place, DC and
+    # Nyquist (for even N) are left unchanged
+    Xf[..., 1:(N + 1) // 2] *= 2
+    Xf[..., N // 2 + 1:] = 0
+
+    analytic_signal = sp_fft.ifft(Xf, axis=-1, workers=-1, overwrite_x=True)
+
+    return np.moveaxis(analytic_signal, -1, 0)
+
+
+def _interp_envelopes(imf, mode='upper'):
+    """
+    Interpolate the amplitude envelope of every time-series in an array of
+    IMFs.
+
+    Parameters
+    ----------
+    imf : ndarray
+        Input array of IMFs, time is assumed to be the first dimension
+    mode : {'upper','lower','combined'}
+         Flag to set which envelope should be computed (Default value = 'upper')
+
+    Returns
+    -------
+    ndarray
+        Interpolated amplitude envelopes, same shape as imf
+
+    """
+
+    # Flatten all non-time dimensions so we only loop once over the IMFs,
+    # each time-series is then a contiguous row
+    flat_imf = _as_time_last(imf.reshape(imf.shape[0], -1))
+
+    env = np.zeros_like(flat_imf)
+    for ii in range(flat_imf.shape[0]):
+        env[ii, :] = utils.interp_envelope(flat_imf[ii, :], mode=mode)
+
+    return env.T.reshape(imf.shape)
+
+
 def quadrature_transform(X):
     """
     Compute the quadrature transform on a set of time-series as defined in
@@ -182,15 +248,21 @@ def quadrature_transform(X):
 
     nX = utils.amplitude_normalise(X.copy(), clip=True)
 
-    imagX = np.lib.scimath.sqrt(1 - np.power(nX, 2)).real
+    # Real valued sqrt, clipping guards against values fractionally outside
+    # [-1, 1] which would otherwise produce nans
+    imagX = 1 - nX * nX
+    np.maximum(imagX, 0, out=imagX)
+    np.sqrt(imagX, out=imagX)
 
-    mask = ((np.diff(nX, axis=0) > 0) * -2) + 1
-    mask[mask == 0] = -1
-    mask = np.r_[mask, mask[-1, None, :]]
+    # Sign of quadrature is negative when the signal is ascending, the last
+    # sample takes the sign of the one before it
+    mask = np.empty_like(nX)
+    np.subtract(1, 2 * (np.diff(nX, axis=0) > 0), out=mask[:-1])
+    mask[-1] = mask[-2]
 
-    q = imagX * mask
+    imagX *= mask
 
-    return nX + 1j * q
+    return nX + 1j * imagX
 
 
 def phase_from_complex_signal(complex_signal, smoothing=None,
@@ -217,33 +289,35 @@ def phase_from_complex_signal(complex_signal, smoothing=None,
 
     """
 
-    # Compute unwrapped phase
-    iphase = np.unwrap(np.angle(complex_signal), axis=0)
+    iphase = np.angle(complex_signal)
 
-    orig_dim = iphase.ndim
-    if iphase.ndim == 2:
-        iphase = iphase[:, :, None]
+    # Unwrapping is only needed for smoothing or if the caller asked for it,
+    # otherwise the phase is wrapped again below
+    if smoothing is not None or ret_phase == 'unwrapped':
+        iphase = utils.unwrap_phase(iphase, axis=0)
 
     # Apply smoothing if requested
     # if smoothing is not None:
     #    iphase = signal.savgol_filter(iphase,smoothing,1,axis=0)
     if smoothing is not None:
-        for ii in range(iphase.shape[1]):
-            for jj in range(iphase.shape[2]):
-                iphase[:, ii, jj] = signal.medfilt(iphase[:, ii, jj], 5)
-
-    if orig_dim == 2:
-        iphase = iphase[:, :, 0]
-
-    # Set phase jump point to requested part of cycle
+        # Filter each time-series as a contiguous row, this is faster than a
+        # single N-D medfilt call with a kernel spanning time only
+        tl_phase = _as_time_last(iphase)
+        flat_phase = tl_phase.reshape(-1, tl_phase.shape[-1])
+        for ii in range(flat_phase.shape[0]):
+            flat_phase[ii, :] = signal.medfilt(flat_phase[ii, :], 5)
+        iphase = np.moveaxis(tl_phase, -1, 0)
+
+    # Set phase jump point to requested part of cycle, iphase is already a
+    # new array so we can modify it in place
     if phase_jump == 'ascending':
-        iphase = iphase + np.pi / 2
+        iphase += np.pi / 2
     elif phase_jump == 'peak':
         pass  # do nothing
     elif phase_jump == 'descending':
-        iphase = iphase - np.pi / 2
+        iphase -= np.pi / 2
     elif phase_jump == 'trough':
-        iphase = iphase + np.pi
+        iphase += np.pi
 
     if ret_phase == 'wrapped':
         return utils.wrap_phase(iphase)
@@ -270,11 +344,19 @@ def freq_from_phase(iphase, sample_rate):
 
     """
 
-    # Differential of instantaneous phase
-    iphase = np.gradient(iphase, axis=0)
+    iphase = np.asarray(iphase)
 
-    # Convert to freq
-    ifrequency = iphase / (2.0 * np.pi) * sample_rate
+    # Differential of instantaneous phase converted to frequency in a single
+    # pass. Central differences in the middle and one-sided differences at
+    # the edges, matching np.gradient
+    scale = sample_rate / (2.0 * np.pi)
+
+    # Integer phases still give float frequencies, float32 is kept as is
+    ifrequency = np.empty(iphase.shape, dtype=np.result_type(iphase, np.float32))
+    np.subtract(iphase[2:], iphase[:-2], out=ifrequency[1:-1])
+    ifrequency[1:-1] *= scale / 2
+    ifrequency[0] = (iphase[1] - iphase[0]) * scale
+    ifrequency[-1] = (iphase[-1] - iphase[-2]) * scale
 
     return ifrequency
 
@@ -330,11 +412,26 @@ def direct_quadrature(fm):
     """
     ph = phase_angle(fm)
 
-    # We'll have occasional nans where fm==1 or -1
-    inds = np.argwhere(np.isnan(ph))
+    # Patch any nans left by missing values in fm with the average of the
+    # nearest valid samples before and after them in the same time-series
+    nans = np.isnan(ph)
+    ntimes = ph.shape[0]
+    tinds = np.arange(ntimes).reshape((-1,) + (1,) * (ph.ndim - 1))
+
+    # Forward and backward fill the index of the last valid sample
+    prev_inds = np.where(nans, 0, tinds)
+    np.maximum.accumulate(prev_inds, axis=0, out=prev_inds)
+    next_inds = np.where(nans, ntimes - 1, tinds)
+    next_inds = np.minimum.accumulate(next_inds[::-1], axis=0)[::-1]
 
-    vals = (ph[inds[:, 0] - 1, :] + ph[inds[:, 0] + 1, :]) / 2
-    ph[inds[:, 0]] = vals
+    prev_vals = np.take_along_axis(ph, prev_inds, axis=0)
+    next_vals = np.take_along_axis(ph, next_inds, axis=0)
+
+    # Nans at the edges only have a valid sample on one side
+    prev_vals = np.where(np.isnan(prev_vals), next_vals, prev_vals)
+    next_vals = np.where(np.isnan(next_vals), prev_vals, next_vals)
+
+    ph[nans] = ((prev_vals + next_vals) / 2)[nans]
 
     return ph
 
@@ -353,8 +450,8 @@ def phase_angle(fm):
 
     Returns
     -------
-    quad_signal : ndarray
-        Complex valued array containing the quadrature transformed signal
+    IP : ndarray
+        Array containing the phase angle of each sample
 
     References
     ----------
@@ -365,7 +462,10 @@ def phase_angle(fm):
 
     """
 
-    return np.arctan(fm / np.lib.scimath.sqrt(1 - np.power(fm, 2)))
+    # Values at or beyond +/-1 divide by zero and map to +/-pi/2
+    quad = np.sqrt(np.maximum(1 - fm * fm, 0))
+    with np.errstate(divide='ignore'):
+        return np.arctan(fm / quad)
 
 # Time-frequency spectra
 
@@ -386,9 +486,10 @@ def holospectrum(infr, infr2, inam2, freq_edges, freq_edges2, mode='energy',
     inam2 : ndarray
         3D second level instantaneous amplitudes
     freq_edges : ndarray
-        Vector of frequency bins for carrier frequencies
+        Vector of frequency bins for carrier frequencies, in ascending order
     freq_edges2 :
-        Vector of frequency bins for amplitude-modulation frequencies
+        Vector of frequency bins for amplitude-modulation frequencies, in
+        ascending order
     mode : {'energy','amplitude'}
          Flag indicating whether to sum the energy or amplitudes (Default value = 'energy')
     return_time : {'sum','mean',False}
@@ -417,45 +518,49 @@ def holospectrum(infr, infr2, inam2, freq_edges, freq_edges2, mode='energy',
 
     """
 
+    if squash_time not in ['sum', 'mean'] and squash_time is not False:
+        raise ValueError("squash_time '{0}' not recognised, please use 'sum', 'mean' or False".format(squash_time))
+
     if mode == 'energy':
         inam2 = inam2**2
 
-    IA_inds = np.digitize(infr2, freq_edges2)
-    infr_inds = np.digitize(infr, freq_edges)
-
-    new_shape = (infr_inds.shape[0], infr_inds.shape[1], infr2.shape[2])
-    infr_inds = np.broadcast_to(infr_inds[:, :, None], new_shape)
-
     fold_dim1 = len(freq_edges) + 1
     fold_dim2 = len(freq_edges2) + 1
+    ntimes = infr.shape[0]
 
-    infr_inds = infr_inds + IA_inds * fold_dim1
-
-    T_inds = np.arange(infr.shape[0])[:, None, None]
-    T_inds = np.broadcast_to(T_inds, new_shape)
+    # Build the linear bin index in place within a single integer array,
+    # carrier frequency and time indices are broadcast rather than
+    # materialised at full size. Bin edges are sorted so searchsorted gives
+    # the same result as digitize without checking monotonicity
+    flat_inds = np.searchsorted(freq_edges2, infr2, side='right')
+    flat_inds *= fold_dim1
+    flat_inds += np.searchsorted(freq_edges, infr, side='right')[:, :, None]
 
-    coords = (T_inds.reshape(-1), infr_inds.reshape(-1))
-    holo = sparse.coo_matrix((inam2.reshape(-1), coords),
-                             shape=(infr.shape[0], fold_dim1 * fold_dim2))
+    # bincount always accumulates in float64, return the input precision
+    dtype = np.result_type(inam2, np.float32)
 
-    # Reduce time-dimension if specified
+    # Scatter-add the amplitudes directly into a dense array, bincount sums
+    # any repeated indices for us
     if squash_time is False:
-        # Return the full matrix
-        holo = holo.toarray().reshape(new_shape[0], fold_dim2, fold_dim1)
-    elif squash_time == 'mean':
-        # Collapse time dimension while we're still sparse
-        holo = holo.mean(axis=0)
-        holo = holo.reshape(fold_dim2, fold_dim1)
-    elif squash_time == 'sum':
-        # Collapse time dimension while we're still sparse
-        holo = holo.sum(axis=0)
-        holo = holo.reshape(fold_dim2, fold_dim1)
+        # Keep the time dimension in the linear index
+        flat_inds += (np.arange(ntimes) * (fold_dim1 * fold_dim2))[:, None, None]
 
-    if squash_time is False:
-        return np.array(holo[:, 1:-1, 1:-1])
-    else:
-        # Alays returns full-array until someone implements N-D sparse in scipy
-        return np.array(holo[1:-1, 1:-1])  # don't return a matrix
+        holo = np.bincount(flat_inds.reshape(-1), weights=inam2.reshape(-1),
+                           minlength=ntimes * fold_dim1 * fold_dim2)
+        holo = holo.astype(dtype, copy=False).reshape(ntimes, fold_dim2, fold_dim1)
+
+        # Copy so we don't keep the padded buffer alive through a view
+        return np.ascontiguousarray(holo[:, 1:-1, 1:-1])
+
+    # Collapse time dimension during accumulation
+    holo = np.bincount(flat_inds.reshape(-1), weights=inam2.reshape(-1),
+                       minlength=fold_dim1 * fold_dim2)
+    holo = holo.astype(dtype, copy=False).reshape(fold_dim2, fold_dim1)
+
+    if squash_time == 'mean':
+        holo = holo / ntimes
+
+    return np.ascontiguousarray(holo[1:-1, 1:-1])
 
 
 def hilberthuang(infr, inam, freq_edges, mode='energy', return_sparse=False):
@@ -471,7 +576,7 @@ def hilberthuang(infr, inam, freq_edges, mode='energy', return_sparse=False):
     inam : ndarray
         2D first level instantaneous amplitudes
     freq_edges : ndarray
-        Vector of frequency bins for carrier frequencies
+        Vector of frequency bins for carrier frequencies, in ascending order
     mode : {'energy','amplitude'}
          Flag indicating whether to sum the energy or amplitudes (Default value = 'energy')
     return_sparse : bool
@@ -503,23 +608,32 @@ def hilberthuang(infr, inam, freq_edges, mode='energy', return_sparse=False):
     if mode == 'energy':
         inam = inam**2
 
-    # Create sparse co-ordinates
-    yinds = np.digitize(infr, freq_edges)
-    xinds = np.tile(np.arange(yinds.shape[0]), (yinds.shape[1], 1)).T
+    nbins = len(freq_edges) - 1
+    ntimes = infr.shape[0]
 
-    coo_data = (inam.reshape(-1), (yinds.reshape(-1), xinds.reshape(-1)))
+    # Frequency and time co-ordinates of each value
+    yinds = np.searchsorted(freq_edges, infr, side='right')
+    xinds = np.arange(ntimes)[:, None]
 
     # Remove values outside our bins
-    goods = np.any(np.c_[coo_data[1][0] < len(freq_edges) - 1, (coo_data[1][0] == 0)], axis=1)
-    coo_data = (coo_data[0][goods], (coo_data[1][0][goods], coo_data[1][1][goods]))
-
-    # Create sparse matrix
-    hht = sparse.coo_matrix(coo_data, shape=(len(freq_edges) - 1, xinds.shape[0]))
+    goods = yinds < nbins
 
     if return_sparse:
-        return hht
-    else:
-        return hht.toarray()
+        # Create sparse matrix
+        xinds = np.broadcast_to(xinds, yinds.shape)
+        coo_data = (inam[goods], (yinds[goods], xinds[goods]))
+        return sparse.coo_matrix(coo_data, shape=(nbins, ntimes))
+
+    # Scatter-add directly into a dense array rather than going through a
+    # sparse matrix, bincount sums any repeated co-ordinates for us
+    flat_inds = yinds * ntimes + xinds
+    hht = np.bincount(flat_inds[goods], weights=inam[goods],
+                      minlength=nbins * ntimes)
+
+    # bincount always accumulates in float64, return the input precision
+    hht = hht.astype(np.result_type(inam, np.float32), copy=False)
+
+    return hht.reshape(nbins, ntimes)
 
 
 def hilberthuang_1d(infr, inam, freq_edges, mode='energy'):
@@ -535,7 +649,7 @@ def hilberthuang_1d(infr, inam, freq_edges, mode='energy'):
     inam : ndarray
         2D first level instantaneous amplitudes
     freq_edges : ndarray
-        Vector of frequency bins for carrier frequencies
+        Vector of frequency bins for carrier frequencies, in ascending order
     mode : {'energy','amplitude'}
          Flag indicating whether to sum the energy or amplitudes (Default value = 'energy')
 
@@ -555,24 +669,36 @@ def hilberthuang_1d(infr, inam, freq_edges, mode='energy'):
 
     """
 
-    specs = np.zeros((len(freq_edges) - 1, infr.shape[1]))
-
     # Remove values outside the bin range
     infr = infr.copy()
     infr[infr < freq_edges[0]] = np.nan
     infr[infr > freq_edges[-1]] = np.nan
 
-    finds = np.digitize(infr, freq_edges)
+    finds = np.searchsorted(freq_edges, infr, side='right')
 
-    for ii in range(1, len(freq_edges)):
-        for jj in range(infr.shape[1]):
+    if mode == 'amplitude':
+        vals = inam
+    elif mode == 'energy':
+        vals = np.power(inam, 2)
+    else:
+        raise ValueError("mode '{0}' not recognised, please use 'energy' or 'amplitude'".format(mode))
 
-            if mode == 'amplitude':
-                specs[ii - 1, jj] = np.nansum(inam[finds[:, jj] == ii, jj])
-            elif mode == 'energy':
-                specs[ii - 1, jj] = np.nansum(np.power(inam[finds[:, jj] == ii, jj], 2))
+    # Missing amplitudes don't contribute to the sum, as with nansum
+    vals = np.where(np.isnan(vals), 0, vals)
 
-    return specs
+    # Offset bin indices of each IMF so that all IMFs can be accumulated in
+    # a single pass. searchsorted returns values between 0 and len(freq_edges)
+    nbins = len(freq_edges) + 1
+    finds = finds + np.arange(infr.shape[1]) * nbins
+
+    # bincount always accumulates in float64, return the input precision
+    specs = np.bincount(finds.reshape(-1), weights=vals.reshape(-1),
+                        minlength=nbins * infr.shape[1])
+    specs = specs.astype(np.result_type(vals, np.float32), copy=False)
+    specs = specs.reshape(infr.shape[1], nbins).T
+
+    # Drop values below and above the bin range
+    return specs[1:-1, :]
 
 
 def define_hist_bins(data_min, data_max, nbins, scale='linear'):
@@ -593,7 +719,7 @@ def define_hist_bins(data_min, data_max, nbins, scale='linear'):
     Returns
     -------
     edges : ndarray
-        1D array of bin edges
+        1D array of bin edges, in ascending order if data_min < data_max
     centres : ndarray
         1D array of bin centres
 
@@ -604,19 +730,34 @@ def define_hist_bins(data_min, data_max, nbins, scale='linear'):
     >> print(centres)
     [1.5 2.5 3.5 4.5]
 
+    Results are cached between calls, the returned arrays are read-only and
+    should be copied before being modified.
+
     """
 
+    if scale not in ['log', 'linear']:
+        raise ValueError('scale \'{0}\' not recognised. please use \'log\' or \'linear\'.'.format(scale))
+
+    return _define_hist_bins(float(data_min), float(data_max), nbins, scale)
+
+
+@functools.lru_cache(maxsize=128)
+def _define_hist_bins(data_min, data_max, nbins, scale):
+    """Cached implementation of define_hist_bins, arguments must be hashable."""
+
     if scale == 'log':
         p = np.log([data_min, data_max])
         edges = np.linspace(p[0], p[1], nbins + 1)
         edges = np.exp(edges)
     elif scale == 'linear':
         edges = np.linspace(data_min, data_max, nbins + 1)
-    else:
-        raise ValueError('scale \'{0}\' not recognised. please use \'log\' or \'linear\'.')
 
     # Get centre frequecy for the bins
-    centres = np.array([(edges[ii] + edges[ii + 1]) / 2 for ii in range(len(edges) - 1)])
+    centres = (edges[:-1] + edges[1:]) / 2
+
+    # Cached arrays are shared between callers so mustn't be modified
+    edges.setflags(write=False)
+    centres.setflags(write=False)
 
     return edges, centres
 
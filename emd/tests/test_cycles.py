@@ -124,3 +124,15 @@ def test_get_cycle_vals():
     # Compute the sum of y within bins of x and return full vector
     bin_counts = get_cycle_stat(x, y, mode='full', metric='sum')
     assert(np.all(bin_counts == x))
+
+
+def test_mean_vector():
+    from ..cycles import mean_vector
+
+    np.random.seed(42)
+    IP = np.random.uniform(0, 2 * np.pi, 500)
+    X = np.random.randn(500, 3)
+
+    mv = mean_vector(IP, X)
+    assert(mv.shape == (3,))
+    assert(np.allclose(mv, (np.exp(1j * IP)[:, None] * X).mean(0)))
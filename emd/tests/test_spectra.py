@@ -37,6 +37,73 @@ class test_spectra(unittest.TestCase):
         assert(IA.mean() - 2 < tol)
         assert(IF.mean() - self.f2 < tol)
 
+    def test_frequency_stats_envelopes(self):
+        from ..spectra import frequency_stats
+        from ..utils import interp_envelope
+
+        # 3D input [samples x imfs x channels] with a different signal in
+        # each time-series
+        time_vect = np.arange(self.x1.shape[0]) / self.sample_rate
+        X = np.zeros((self.x1.shape[0], 2, 3))
+        for ii in range(X.shape[1]):
+            for jj in range(X.shape[2]):
+                f = self.f1 * (ii + 1) + jj
+                X[:, ii, jj] = (jj + 1) * np.cos(2 * np.pi * f * time_vect)
+
+        for method in ['quad', 'nht']:
+            IP, IF, IA = frequency_stats(X, self.sample_rate, method)
+            assert(IA.shape == X.shape)
+            for ii in range(X.shape[1]):
+                for jj in range(X.shape[2]):
+                    assert(np.allclose(IA[:, ii, jj], interp_envelope(X[:, ii, jj], mode='upper')))
+
+    def test_frequency_stats_precision(self):
+        from ..spectra import frequency_stats, quadrature_transform
+
+        # Single precision inputs should not be upcast
+        x = self.x1.astype(np.float32)
+        IP, IF, IA = frequency_stats(x, self.sample_rate, 'hilbert')
+        assert(IP.dtype == np.float32)
+        assert(IF.dtype == np.float32)
+        assert(IA.dtype == np.float32)
+
+        assert(quadrature_transform(x).dtype == np.complex64)
+
+    def test_phase_from_complex_signal(self):
+        from ..spectra import phase_from_complex_signal
+
+        # Long, fast phase ramp to check we don't accumulate unwrap errors
+        phase = np.linspace(0, 2 * np.pi * 5000, 200000)[:, None]
+        IP = phase_from_complex_signal(np.exp(1j * phase), ret_phase='unwrapped', phase_jump='peak')
+        assert(np.allclose(IP, phase, rtol=0, atol=1e-10))
+
+    def test_direct_quadrature(self):
+        from ..spectra import direct_quadrature, phase_angle
+
+        fm = np.sin(np.linspace(0, np.pi / 2, 10))[:, None] * np.array([.9, .5])
+        fm[0, 0] = np.nan
+        fm[4, 1] = np.nan
+        fm[5, 1] = np.nan
+
+        ph = direct_quadrature(fm)
+        ref = phase_angle(fm)
+
+        # Edge nans take their only neighbour, others the average of both
+        assert(not np.any(np.isnan(ph)))
+        assert(ph[0, 0] == ref[1, 0])
+        assert(np.allclose(ph[4:6, 1], (ref[3, 1] + ref[6, 1]) / 2))
+
+        # Valid samples, including other time-series at nan rows, are unchanged
+        assert(np.all(ph[1:, 0] == ref[1:, 0]))
+        assert(np.all(ph[:4, 1] == ref[:4, 1]))
+
+        # 3D input [samples x imfs x channels]
+        fm = np.ones((20, 3, 2)) * .5
+        fm[5, 1, 0] = np.nan
+        ph = direct_quadrature(fm)
+        assert(ph.shape == (20, 3, 2))
+        assert(np.allclose(ph, np.arctan(.5 / np.sqrt(.75))))
+
     def test_freq_from_phase(self):
         from ..spectra import freq_from_phase
 
@@ -49,6 +116,12 @@ class test_spectra(unittest.TestCase):
         tst = freq_from_phase(np.linspace(0, 2 * np.pi * 2, 48), 47)
         assert(np.allclose(tst, 2))
 
+        tst = freq_from_phase(np.arange(10), 2 * np.pi)
+        assert(np.allclose(tst, 1))
+
+        tst = freq_from_phase([0, 1, 2, 3], 2 * np.pi)
+        assert(np.allclose(tst, 1))
+
     def test_phase_from_freq(self):
         from ..spectra import phase_from_freq
 
@@ -57,6 +130,19 @@ class test_spectra(unittest.TestCase):
         phs = phase_from_freq(np.ones((100,)), sample_rate=100)
         assert(phs.max() - np.pi < tol)
 
+    def test_hilberthuang(self):
+        from ..spectra import hilberthuang
+
+        IF = np.array([[1, 5], [3, 9], [11, 7]])
+        IA = np.array([[1, 2], [3, 4], [5, 6]], dtype=float)
+        edges = np.linspace(0, 12, 4)
+
+        hht = hilberthuang(IF, IA, edges, mode='amplitude')
+        assert(np.all(hht.shape == (3, 3)))
+
+        hht_sparse = hilberthuang(IF, IA, edges, mode='amplitude', return_sparse=True)
+        assert(np.all(hht_sparse.toarray() == hht))
+
     def test_hilberthunang_1d(self):
         from ..spectra import hilberthuang_1d
 
@@ -80,6 +166,12 @@ class test_spectra(unittest.TestCase):
         spec = hilberthuang_1d(IF, IA, edges, mode='energy')
         assert(np.all(spec[:, 0] == [12, 12, 12, 12]))
 
+        # Missing amplitudes are ignored, infinite ones are kept
+        IA[0] = np.nan
+        IA[-2] = np.inf
+        spec = hilberthuang_1d(IF, IA, edges, mode='amplitude')
+        assert(np.all(spec[:, 0] == [4, 6, 6, np.inf]))
+
 
 class test_hists(unittest.TestCase):
 
@@ -103,6 +195,11 @@ class test_hists(unittest.TestCase):
         assert(np.all(edges == np.array([0., 0.2, 0.4, 0.6, 0.8, 1.])))
         assert(np.all(bins == np.array([0.1, 0.3, 0.5, 0.7, 0.9])))
 
+        # Cached bins are shared between calls so must be read-only
+        edges, bins = define_hist_bins(0, 1, 5)
+        assert(not edges.flags.writeable)
+        assert(not bins.flags.writeable)
+
 
 class test_holo(unittest.TestCase):
 
@@ -119,3 +216,17 @@ class test_holo(unittest.TestCase):
         holo = holospectrum(if1, if2, ia2, f_edges1, f_edges2, squash_time=False)
 
         assert(np.all(holo.shape == (2, 5, 5)))
+        assert(holo.flags.c_contiguous and holo.base is None)
+        assert(holo[0, 1, 1] == 1)
+        assert(holo[1, 1, 3] == 4)
+        assert(holo.sum() == 5)
+
+        holo = holospectrum(if1, if2, ia2, f_edges1, f_edges2, squash_time='sum')
+
+        assert(np.all(holo.shape == (5, 5)))
+        assert(holo[1, 1] == 1)
+        assert(holo[1, 3] == 4)
+        assert(holo.sum() == 5)
+
+        with self.assertRaises(ValueError):
+            holospectrum(if1, if2, ia2, f_edges1, f_edges2, squash_time='max')
@@ -17,6 +17,7 @@ est_orthogonality
 find_extrema_locked_epochs
 apply_epochs
 wrap_phase
+unwrap_phase
 
 """
 
@@ -191,8 +192,9 @@ def interp_envelope(X, mode='upper', interp_method='splrep'):
     if locs is None:
         return None
 
-    # Run interpolation on envelope
-    t = np.arange(locs[0], locs[-1])
+    # Run interpolation on envelope, padded extrema extend beyond the signal
+    # but we only need to evaluate the envelope within it
+    t = np.arange(max(locs[0], 0), min(locs[-1], X.shape[0]))
     if interp_method == 'splrep':
         f = interp.splrep(locs, pks)
         env = interp.splev(t, f)
@@ -203,11 +205,6 @@ def interp_envelope(X, mode='upper', interp_method='splrep'):
         pchip = interp.pchip(locs, pks)
         env = pchip(t)
 
-    t_max = np.arange(locs[0], locs[-1])
-    tinds = np.logical_and((t_max >= 0), (t_max < X.shape[0]))
-
-    env = np.array(env[tinds])
-
     if env.shape[0] != X.shape[0]:
         raise ValueError('Envelope length does not match input data {0} {1}'.format(
             env.shape[0], X.shape[0]))
@@ -463,3 +460,41 @@ def wrap_phase(IP, ncycles=1, mode='2pi'):
         phases = (IP + (np.pi * ncycles)) % (ncycles * 2 * np.pi) - (np.pi * ncycles)
 
     return phases
+
+
+def unwrap_phase(IP, axis=0):
+    """
+    Unwrap a phase time-course by removing jumps of 2pi between samples.
+
+    Jumps are counted as integer numbers of cycles and only converted back to
+    radians once at the end. This avoids the rounding error which accumulates
+    when summing floating point corrections over long time-courses.
+
+    Parameters
+    ----------
+    IP : ndarray
+        Input array of wrapped phase values
+    axis : int
+         Axis along which to unwrap (Default value = 0)
+
+    Returns
+    -------
+    ndarray
+        Unwrapped phase time-course
+
+    """
+    IP = np.asarray(IP)
+
+    # Number of whole cycles jumped between each pair of samples, missing
+    # values are left in place rather than propagated along the time-course
+    jumps = np.round(np.diff(IP, axis=axis) / (2 * np.pi))
+    jumps = np.nan_to_num(jumps, copy=False).astype(np.int32)
+    ncycles = np.cumsum(jumps, axis=axis)
+
+    tail = [slice(None)] * IP.ndim
+    tail[axis] = slice(1, None)
+
+    phases = IP.copy()
+    phases[tuple(tail)] -= (2 * np.pi) * ncycles
+
+    return phases
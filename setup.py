@@ -57,7 +57,7 @@ setup(
     python_requires='>3.4',
 
     install_requires=['numpy',
-                      'scipy',
+                      'scipy>=1.4.0',
                       'matplotlib',
                       'numpydoc',
                       'sphinx_rtd_theme'],